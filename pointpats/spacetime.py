@@ -18,10 +18,16 @@ __all__ = [
     "modified_knox",
     "Knox",
     "KnoxLocal",
+    "knox_batch",
 ]
 
+import hashlib
+import multiprocessing
 import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date
+from functools import lru_cache
 from warnings import warn
 
 import geopandas as gpd
@@ -34,9 +40,177 @@ from libpysal import cg
 from libpysal.graph import Graph
 from pandas.api.types import is_numeric_dtype
 from scipy.spatial import KDTree
+from scipy.spatial.distance import pdist
 from scipy.stats import hypergeom, poisson
 from shapely.geometry import LineString
 
+# numpy implementations of the permutation kernels, used when numba is not
+# installed and kept available to check the compiled kernels against
+
+
+def _knox_perm_kernel_numpy(s_indptr, s_indices, t, tau, perms, _stop_at):
+    """Count space-time pairs under each permutation of the time labels.
+
+    rids[j] is a temporal neighbor of rids[i] exactly when their times are
+    within tau, so membership is a vectorized comparison over the spatial
+    pairs rather than a set lookup per neighbor. The vectorized counts are
+    always exact, so the early-exit bound _stop_at (kept for a signature
+    shared with the compiled kernel) is ignored.
+    """
+    s_rows = np.repeat(np.arange(len(s_indptr) - 1), np.diff(s_indptr))
+    counts = np.empty(perms.shape[0], dtype=np.int32)
+    # whole blocks of permutations at once, sized to bound the
+    # (block, pairs) temporaries
+    block = max(1, 2**22 // max(len(s_indices), 1))
+    for start in range(0, perms.shape[0], block):
+        t_perm = t[perms[start : start + block]]
+        counts[start : start + block] = np.count_nonzero(
+            np.abs(t_perm[:, s_rows] - t_perm[:, s_indices]) <= tau, axis=1
+        )
+    return counts
+
+
+def _knox_local_perm_kernel_numpy(indptr, indices, t, tau, perms, focal, nsti, keep):
+    """Conditional permutation counts of local space-time neighbors.
+
+    Each permutation is reused for every focal unit i by swapping labels
+    so that i keeps its own time: a spatial neighbor j of i that drew
+    label i receives the label drawn by i instead. A block of
+    permutations is scored at once over the directed spatial pairs of
+    all focal units, and each unit's count is the sum over its
+    contiguous run of pairs.
+    """
+    permutations, n = perms.shape
+    degree = np.diff(indptr)
+    rows = np.repeat(np.arange(n), degree)
+    is_focal = np.zeros(n, dtype=bool)
+    is_focal[focal] = True
+    cols = indices[is_focal[rows]]
+    rows = rows[is_focal[rows]]
+    bounds = np.concatenate(([0], np.cumsum(degree[focal])))
+    exceedence = np.zeros(len(focal), dtype=np.int64)
+    sti = np.zeros((len(focal), permutations if keep else 0), dtype=np.int32)
+    block = max(1, 2**22 // max(len(cols), 1))
+    for start in range(0, permutations, block):
+        rids = perms[start : start + block]
+        labels = rids[:, cols]
+        labels = np.where(labels == rows, rids[:, rows], labels)
+        hits = np.zeros((rids.shape[0], len(cols) + 1), dtype=np.int32)
+        np.cumsum(np.abs(t[rows] - t[labels]) <= tau, axis=1, out=hits[:, 1:])
+        counts = hits[:, bounds[1:]] - hits[:, bounds[:-1]]
+        exceedence += np.count_nonzero(counts >= nsti[focal], axis=0)
+        if keep:
+            sti[:, start : start + rids.shape[0]] = counts.T
+    return exceedence, sti
+
+
+try:
+    from numba import njit, prange, set_num_threads
+
+    HAS_NUMBA = True
+
+    @njit(parallel=True, cache=True)
+    def _knox_perm_kernel(s_indptr, s_indices, t, tau, perms, stop_at):
+        """Count space-time pairs under each permutation of the time labels.
+
+        Spatial neighbors are given as upper-triangular CSR arrays so each
+        pair is visited once; membership in the temporal neighborhood of the
+        permuted label reduces to a threshold test on the permuted times.
+        Counting a permutation stops once it reaches stop_at, so counts are
+        exact only below that bound.
+
+        The permuted times are gathered once per permutation so the inner
+        loop is a single gather, subtract, compare and add without branches,
+        which LLVM turns into SIMD gathers.
+        """
+        permutations, n = perms.shape
+        counts = np.zeros(permutations, dtype=np.int32)
+        for p in prange(permutations):
+            t_perm = t[perms[p]]
+            st = 0
+            for i in range(n):
+                ti = t_perm[i]
+                for k in range(s_indptr[i], s_indptr[i + 1]):
+                    st += abs(ti - t_perm[s_indices[k]]) <= tau
+                if st >= stop_at:
+                    break
+            counts[p] = st
+        return counts
+
+    @njit(parallel=True, cache=True)
+    def _count_pairs_le(t, i0, i1, tau2):
+        """Count pairs whose squared temporal difference is at most tau2.
+
+        The subtract, square and compare steps are fused into a single
+        reduction over the pairs, which LLVM vectorizes and prange splits
+        across threads.
+        """
+        count = 0
+        for k in prange(i0.shape[0]):
+            d = t[i0[k]] - t[i1[k]]
+            if d * d <= tau2:
+                count += 1
+        return count
+
+    @njit(parallel=True, cache=True)
+    def _count_pairs_le_perms(t, i0, i1, tau2, perms):
+        """Count pairs within tau2 for every row of a permutation matrix.
+
+        Permutations are independent, so the batch is split across threads
+        over its rows and each thread streams through the full pair list.
+        """
+        permutations = perms.shape[0]
+        counts = np.zeros(permutations, dtype=np.int32)
+        for p in prange(permutations):
+            t_perm = t[perms[p]]
+            count = 0
+            for k in range(i0.shape[0]):
+                d = t_perm[i0[k]] - t_perm[i1[k]]
+                count += d * d <= tau2
+            counts[p] = count
+        return counts
+
+    @njit(parallel=True, cache=True)
+    def _knox_local_perm_kernel(indptr, indices, t, tau, perms, focal, nsti, keep):
+        """Conditional permutation counts of local space-time neighbors.
+
+        Each permutation is reused for every focal unit i by swapping labels
+        so that i keeps its own time: a spatial neighbor j of i that drew
+        label i receives the label drawn by i instead. Only the labels drawn
+        at the spatial neighbors of i are read. Focal units are split across
+        threads, each owning its row of the outputs.
+        """
+        permutations = perms.shape[0]
+        m = focal.shape[0]
+        exceedence = np.zeros(m, dtype=np.int64)
+        sti = np.zeros((m, permutations if keep else 0), dtype=np.int32)
+        for f in prange(m):
+            i = focal[f]
+            ti = t[i]
+            for p in range(permutations):
+                rids = perms[p]
+                count = 0
+                for k in range(indptr[i], indptr[i + 1]):
+                    label = rids[indices[k]]
+                    if label == i:
+                        label = rids[i]
+                    if abs(ti - t[label]) <= tau:
+                        count += 1
+                        # only the exceedence is needed unless draws are kept
+                        if not keep and count >= nsti[i]:
+                            break
+                if count >= nsti[i]:
+                    exceedence[f] += 1
+                if keep:
+                    sti[f, p] = count
+        return exceedence, sti
+
+except ModuleNotFoundError:
+    HAS_NUMBA = False
+
+    _knox_perm_kernel = _knox_perm_kernel_numpy
+    _knox_local_perm_kernel = _knox_local_perm_kernel_numpy
+
 
 class SpaceTimeEvents:
     """
@@ -144,16 +318,11 @@ class SpaceTimeEvents:
         dbf_tail = tail.split(".")[0] + ".dbf"
         dbf = lps.io.open(lps.examples.get_path(dbf_tail))
 
-        # extract the spatial coordinates from the shapefile
-        x = [coords[0] for coords in shp]
-        y = [coords[1] for coords in shp]
-
-        self.n = n = len(shp)
-        x = np.array(x)
-        y = np.array(y)
-        self.x = np.reshape(x, (n, 1))
-        self.y = np.reshape(y, (n, 1))
-        self.space = np.hstack((self.x, self.y))
+        # extract the spatial coordinates from the shapefile in a single pass
+        self.space = np.asarray([tuple(coords) for coords in shp], dtype=np.float64)
+        self.n = n = self.space.shape[0]
+        self.x = self.space[:, :1]
+        self.y = self.space[:, 1:2]
 
         # extract the temporal information from the database
         if infer_timestamp:
@@ -179,7 +348,9 @@ class SpaceTimeEvents:
         shp.close()
 
 
-def knox(s_coords, t_coords, delta, tau, permutations=99, debug=False):
+def knox(
+    s_coords, t_coords, delta, tau, permutations=99, debug=False, early_stop_alpha=None
+):
     """
     Knox test for spatio-temporal interaction. :cite:`Knox:1964`
 
@@ -199,6 +370,11 @@ def knox(s_coords, t_coords, delta, tau, permutations=99, debug=False):
     debug           : bool, optional
                       if true, debugging information is printed (the default is
                       False).
+    early_stop_alpha : float, optional
+                      stop drawing permutations once the pseudo p-value can no
+                      longer fall to this significance level, and report the
+                      p-value from the permutations drawn so far (the default
+                      is None, which always runs all permutations).
 
     Returns
     -------
@@ -258,33 +434,72 @@ def knox(s_coords, t_coords, delta, tau, permutations=99, debug=False):
     kd_s = cg.KDTree(s_coords)
     neigh_s = kd_s.query_pairs(delta)
     tau2 = tau * tau
-    ids = np.array(list(neigh_s))
+    ids = np.array(list(neigh_s), dtype=int).reshape(-1, 2)
+    i0 = ids[:, 0].copy()
+    i1 = ids[:, 1].copy()
+    t_flat = np.asarray(t_coords, dtype=float).ravel()
+    n = t_flat.shape[0]
 
     # For the neighboring pairs in space, determine which are also time
-    # neighbors
+    # neighbors. Without numba the buffers are reused across permutations to
+    # avoid allocating temporaries of size |pairs| on every draw.
 
-    d_t = (t_coords[ids[:, 0]] - t_coords[ids[:, 1]]) ** 2
-    n_st = sum(d_t <= tau2)
+    diff = np.empty(i0.shape[0], dtype=float)
+    mask = np.empty(i0.shape[0], dtype=bool)
 
-    knox_result = {"stat": n_st[0]}
+    def count_st(t):
+        if HAS_NUMBA:
+            return _count_pairs_le(t, i0, i1, tau2)
+        np.subtract(t[i0], t[i1], out=diff)
+        np.less_equal(np.square(diff, out=diff), tau2, out=mask)
+        return np.count_nonzero(mask)
+
+    n_st = count_st(t_flat)
+
+    knox_result = {"stat": n_st}
 
     if permutations:
-        joint = np.zeros((permutations, 1), int)
-        for p in range(permutations):
-            np.random.shuffle(t_coords)
-            d_t = (t_coords[ids[:, 0]] - t_coords[ids[:, 1]]) ** 2
-            joint[p] = np.sum(d_t <= tau2)
-
-        larger = sum(joint >= n_st[0])
-        if (permutations - larger) < larger:
-            larger = permutations - larger
-        p_sim = (larger + 1.0) / (permutations + 1.0)
+        joint = np.empty(permutations, dtype=np.int32)
+        # shuffling the index vector in place draws the same sequence of
+        # permutations as shuffling t_coords itself, without mutating the input
+        perm_indices = np.arange(n)
+        if HAS_NUMBA and early_stop_alpha is None:
+            perms = np.empty((permutations, n), dtype=perm_indices.dtype)
+            for p in range(permutations):
+                np.random.shuffle(perm_indices)
+                perms[p] = perm_indices
+            joint[:] = _count_pairs_le_perms(t_flat, i0, i1, tau2, perms)
+        else:
+            larger = 0
+            for p in range(permutations):
+                np.random.shuffle(perm_indices)
+                joint[p] = count_st(t_flat[perm_indices])
+                larger += joint[p] >= n_st
+                # the test is two-sided, so both tails have to be out of reach
+                if _stop_early(
+                    min(larger, p + 1 - larger), early_stop_alpha, permutations
+                ):
+                    joint = joint[: p + 1]
+                    break
+
+        drawn = joint.shape[0]
+        larger = np.count_nonzero(joint >= n_st)
+        if (drawn - larger) < larger:
+            larger = drawn - larger
+        p_sim = (larger + 1.0) / (drawn + 1.0)
         knox_result["pvalue"] = p_sim
     return knox_result
 
 
 def mantel(
-    s_coords, t_coords, permutations=99, scon=1.0, spow=-1.0, tcon=1.0, tpow=-1.0
+    s_coords,
+    t_coords,
+    permutations=99,
+    scon=1.0,
+    spow=-1.0,
+    tcon=1.0,
+    tpow=-1.0,
+    early_stop_alpha=None,
 ):
     """
     Standardized Mantel test for spatio-temporal interaction. :cite:`Mantel:1967`
@@ -308,6 +523,11 @@ def mantel(
     tpow            : float, optional
                       value for power transformation for temporal distances
                       (the default is -1.0).
+    early_stop_alpha : float, optional
+                      stop drawing permutations once the pseudo p-value can no
+                      longer fall to this significance level, and report the
+                      p-value from the permutations drawn so far (the default
+                      is None, which always runs all permutations).
 
     Returns
     -------
@@ -364,39 +584,46 @@ def mantel(
     s = s_coords
     n = len(t)
 
-    # calculate the spatial and temporal distance matrices for the events
-    distmat = cg.distance_matrix(s)
-    timemat = cg.distance_matrix(t)
+    # calculate the condensed spatial and temporal distances for the events
+    distvec = (pdist(np.asarray(s).reshape(n, -1)) + scon) ** spow
+    timevec = (pdist(np.asarray(t).reshape(n, -1)) + tcon) ** tpow
 
     # calculate the transformed standardized statistic
-    timevec = (timemat[np.tril_indices(timemat.shape[0], k=-1)] + tcon) ** tpow
-    distvec = (distmat[np.tril_indices(distmat.shape[0], k=-1)] + scon) ** spow
     stat = stats.pearsonr(timevec, distvec)[0].sum()
 
     # return the results (if no inference)
     if not permutations:
         return stat
 
+    # permuting the labels only reorders the temporal distances, so their mean
+    # and standard deviation are fixed and the correlation reduces to a dot
+    # product with the standardized spatial distances
+    m = len(distvec)
+    distvec_std = (distvec - distvec.mean()) / distvec.std()
+    timevec_std = timevec.std()
+    triu_i, triu_j = np.triu_indices(n, k=1)
+
     # loop for generating a random distribution to assess significance
-    dist = []
-    for _i in range(permutations):
-        trand = _shuffle_matrix(timemat, np.arange(n))
-        timevec = (trand[np.tril_indices(trand.shape[0], k=-1)] + tcon) ** tpow
-        m = stats.pearsonr(timevec, distvec)[0].sum()
-        dist.append(m)
+    distribution = np.empty(permutations)
+    count = 0
+    for i, perm in enumerate(_permutation_matrix(n, permutations)):
+        distribution[i] = np.dot(
+            timevec[_condensed_index(perm[triu_i], perm[triu_j], n)], distvec_std
+        ) / (m * timevec_std)
+        count += distribution[i] >= stat
+        if _stop_early(count, early_stop_alpha, permutations):
+            distribution = distribution[: i + 1]
+            break
 
     # establish the pseudo significance of the observed statistic
-    distribution = np.array(dist)
-    greater = np.ma.masked_greater_equal(distribution, stat)
-    count = np.ma.count_masked(greater)
-    pvalue = (count + 1.0) / (permutations + 1.0)
+    pvalue = (count + 1.0) / (distribution.shape[0] + 1.0)
 
     # report the results
     mantel_result = {"stat": stat, "pvalue": pvalue}
     return mantel_result
 
 
-def jacquez(s_coords, t_coords, k, permutations=99):
+def jacquez(s_coords, t_coords, k, permutations=99, early_stop_alpha=None):
     """
     Jacquez k nearest neighbors test for spatio-temporal interaction.
     :cite:`Jacquez:1996`
@@ -412,6 +639,11 @@ def jacquez(s_coords, t_coords, k, permutations=99):
     permutations    : int, optional
                       the number of permutations used to establish pseudo-
                       significance (the default is 99).
+    early_stop_alpha : float, optional
+                      stop drawing permutations once the pseudo p-value can no
+                      longer fall to this significance level, and report the
+                      p-value from the permutations drawn so far (the default
+                      is None, which always runs all permutations).
 
     Returns
     -------
@@ -461,57 +693,40 @@ def jacquez(s_coords, t_coords, k, permutations=99):
     n = len(time)
 
     # calculate the nearest neighbors in space and time separately
-    knnt = lps.weights.KNN.from_array(time, k)
-    knns = lps.weights.KNN.from_array(space, k)
+    nnt = _knn_indices(time, k)
+    nns = _knn_indices(space, k)
 
-    nnt = knnt.neighbors
-    nns = knns.neighbors
-    knn_sum = 0
-
-    # determine which events are nearest neighbors in both space and time
-    for i in range(n):
-        t_neighbors = nnt[i]
-        s_neighbors = nns[i]
-        check = set(t_neighbors)
-        inter = check.intersection(s_neighbors)
-        count = len(inter)
-        knn_sum += count
-
-    stat = knn_sum
+    # determine which events are nearest neighbors in both space and time by
+    # broadcasting each (k, ) row of temporal neighbors against the spatial ones
+    stat = np.count_nonzero(nnt[:, :, None] == nns[:, None, :])
 
     # return the results (if no inference)
     if not permutations:
         return stat
 
     # loop for generating a random distribution to assess significance
-    dist = []
-    for _p in range(permutations):
-        j = 0
-        trand = np.random.permutation(time)
-        knnt = lps.weights.KNN.from_array(trand, k)
-        nnt = knnt.neighbors
-        for i in range(n):
-            t_neighbors = nnt[i]
-            s_neighbors = nns[i]
-            check = set(t_neighbors)
-            inter = check.intersection(s_neighbors)
-            count = len(inter)
-            j += count
-
-        dist.append(j)
+    distribution = np.empty(permutations, dtype=np.int32)
+    count = 0
+    time = np.asarray(time)
+    for p, perm in enumerate(_permutation_matrix(n, permutations)):
+        nnt = _knn_indices(time[perm], k)
+        distribution[p] = np.count_nonzero(nnt[:, :, None] == nns[:, None, :])
+        count += distribution[p] >= stat
+        if _stop_early(count, early_stop_alpha, permutations):
+            distribution = distribution[: p + 1]
+            break
 
     # establish the pseudo significance of the observed statistic
-    distribution = np.array(dist)
-    greater = np.ma.masked_greater_equal(distribution, stat)
-    count = np.ma.count_masked(greater)
-    pvalue = (count + 1.0) / (permutations + 1.0)
+    pvalue = (count + 1.0) / (distribution.shape[0] + 1.0)
 
     # report the results
     jacquez_result = {"stat": stat, "pvalue": pvalue}
     return jacquez_result
 
 
-def modified_knox(s_coords, t_coords, delta, tau, permutations=99):
+def modified_knox(
+    s_coords, t_coords, delta, tau, permutations=99, early_stop_alpha=None
+):
     """
     Baker's modified Knox test for spatio-temporal interaction.
     :cite:`Baker:2004`
@@ -529,6 +744,11 @@ def modified_knox(s_coords, t_coords, delta, tau, permutations=99):
     permutations    : int, optional
                       the number of permutations used to establish pseudo-
                       significance (the default is 99).
+    early_stop_alpha : float, optional
+                      stop drawing permutations once the pseudo p-value can no
+                      longer fall to this significance level, and report the
+                      p-value from the permutations drawn so far (the default
+                      is None, which always runs all permutations).
 
     Returns
     -------
@@ -578,30 +798,25 @@ def modified_knox(s_coords, t_coords, delta, tau, permutations=99):
     0.11
 
     """
-    s = s_coords
-    t = t_coords
+    s = np.asarray(s_coords)
+    t = np.asarray(t_coords, dtype=float).ravel()
     n = len(t)
 
-    # calculate the spatial and temporal distance matrices for the events
-    sdistmat = cg.distance_matrix(s)
-    tdistmat = cg.distance_matrix(t)
+    # spatial neighbor pairs within delta, stored sparsely rather than as a
+    # dense (n, n) distance matrix
+    pairs = KDTree(s).query_pairs(delta, output_type="ndarray")
+    pi = pairs[:, 0]
+    pj = pairs[:, 1]
+    ssumvec = np.bincount(pairs.ravel(), minlength=n)
 
-    # identify events within thresholds
-    spacmat = np.ones((n, n))
-    spacbin = sdistmat <= delta
-    spacmat = spacmat * spacbin
-    timemat = np.ones((n, n))
-    timebin = tdistmat <= tau
-    timemat = timemat * timebin
+    # number of temporal neighbors for each event from the sorted times
+    tsumvec = _temporal_degrees(t, tau)
 
     # calculate the observed (original) statistic
-    knoxmat = timemat * spacmat
-    obsstat = knoxmat.sum() - n
+    obsstat = 2.0 * np.count_nonzero(np.abs(t[pi] - t[pj]) <= tau)
 
     # calculate the expectated value
-    ssumvec = np.reshape((spacbin.sum(axis=0) - 1), (n, 1))
-    tsumvec = np.reshape((timebin.sum(axis=0) - 1), (n, 1))
-    expstat = (ssumvec * tsumvec).sum()
+    expstat = np.dot(ssumvec, tsumvec)
 
     # calculate the modified stat
     stat = (obsstat - (expstat / (n - 1.0))) / 2.0
@@ -609,60 +824,348 @@ def modified_knox(s_coords, t_coords, delta, tau, permutations=99):
     # return results (if no inference)
     if not permutations:
         return stat
-    distribution = []
+    distribution = np.empty(permutations)
+    count = 0
 
-    # loop for generating a random distribution to assess significance
-    for _p in range(permutations):
-        rtdistmat = _shuffle_matrix(tdistmat, list(range(n)))
-        timemat = np.ones((n, n))
-        timebin = rtdistmat <= tau
-        timemat = timemat * timebin
+    # loop for generating a random distribution to assess significance. The
+    # temporal neighbor counts are permuted along with the times, so only the
+    # spatial pairs need to be rescanned
+    for p, perm in enumerate(_permutation_matrix(n, permutations)):
+        tperm = t[perm]
 
         # calculate the observed knox again
-        knoxmat = timemat * spacmat
-        obsstat = knoxmat.sum() - n
+        obsstat = 2.0 * np.count_nonzero(np.abs(tperm[pi] - tperm[pj]) <= tau)
 
         # calculate the expectated value again
-        ssumvec = np.reshape((spacbin.sum(axis=0) - 1), (n, 1))
-        tsumvec = np.reshape((timebin.sum(axis=0) - 1), (n, 1))
-        expstat = (ssumvec * tsumvec).sum()
+        expstat = np.dot(ssumvec, tsumvec[perm])
 
         # calculate the modified stat
-        tempstat = (obsstat - (expstat / (n - 1.0))) / 2.0
-        distribution.append(tempstat)
+        distribution[p] = (obsstat - (expstat / (n - 1.0))) / 2.0
+        count += distribution[p] >= stat
+        if _stop_early(count, early_stop_alpha, permutations):
+            distribution = distribution[: p + 1]
+            break
 
     # establish the pseudo significance of the observed statistic
-    distribution = np.array(distribution)
-    greater = np.ma.masked_greater_equal(distribution, stat)
-    count = np.ma.count_masked(greater)
-    pvalue = (count + 1.0) / (permutations + 1.0)
+    pvalue = (count + 1.0) / (distribution.shape[0] + 1.0)
 
     # return results
     modknox_result = {"stat": stat, "pvalue": pvalue}
     return modknox_result
 
 
-def _shuffle_matrix(X, ids):
+def _knn_indices(coords, k):
+    """
+    Indices of the k nearest neighbors of each observation, excluding itself.
+
+    Matches the neighbor sets of ``libpysal.weights.KNN`` without building
+    a weights object.
+
+    Parameters
+    ----------
+    coords : array
+             (n, d), coordinates of the observations.
+    k      : int
+             the number of nearest neighbors.
+
+    Returns
+    -------
+           : array
+             (n, k), neighbor indices of each observation.
+    """
+    coords = np.asarray(coords).reshape(len(coords), -1)
+    n = coords.shape[0]
+    indices = KDTree(coords).query(coords, k=k + 1)[1]
+    not_self = indices != np.arange(n).reshape(-1, 1)
+    # with enough duplicate points the observation itself may not be among
+    # its k+1 nearest, in which case the farthest candidate is dropped
+    not_self[not_self.sum(axis=1) == k + 1, -1] = False
+    return indices[not_self].reshape(n, k)
+
+
+def _condensed_index(i, j, n):
+    """
+    Position of pairs (i, j) in a condensed distance vector from ``pdist``.
+
+    Parameters
+    ----------
+    i : array
+        (m, ), first index of each pair.
+    j : array
+        (m, ), second index of each pair, distinct from ``i``.
+    n : int
+        number of observations.
+
+    Returns
+    -------
+      : array
+        (m, ), offsets into the condensed vector of length n(n-1)/2.
+    """
+    lo = np.minimum(i, j)
+    hi = np.maximum(i, j)
+    return n * lo - lo * (lo + 1) // 2 + hi - lo - 1
+
+
+def _permutation_matrix(n, permutations):
+    """
+    Draw all label permutations used for inference in one block.
+
+    Rows are drawn from the global ``numpy.random`` state, one after the
+    other, so results remain reproducible with ``numpy.random.seed`` and
+    match drawing the permutations inside the loop. Each row is shuffled in
+    place, consuming the same draws as ``numpy.random.permutation(n)``
+    without allocating a temporary per row.
+
+    Parameters
+    ----------
+    n            : int
+                   number of observations.
+    permutations : int
+                   number of permutations.
+
+    Returns
+    -------
+                 : array
+                   (permutations, n), each row a permutation of range(n).
+    """
+    perms = np.empty((permutations, n), dtype=np.intp)
+    perms[:] = np.arange(n)
+    for row in perms:
+        np.random.shuffle(row)
+    return perms
+
+
+def _permutation_blocks(n, permutations, size=2**20):
+    """
+    Yield the rows of ``_permutation_matrix(n, permutations)`` in blocks.
+
+    Blocks are drawn in order from the global ``numpy.random`` state, so the
+    stacked blocks equal the full matrix while only one block of at most
+    ``size`` labels is held at a time.
+
+    Parameters
+    ----------
+    n            : int
+                   number of observations.
+    permutations : int
+                   number of permutations.
+    size         : int
+                   maximum number of labels in a block.
+
+    Yields
+    ------
+                 : array
+                   (b, n), consecutive rows of the permutation matrix.
+    """
+    step = max(1, size // max(n, 1))
+    for start in range(0, permutations, step):
+        yield _permutation_matrix(n, min(step, permutations - start))
+
+
+def _stop_early(exceedence, alpha, permutations):
+    """
+    Whether further permutations can no longer make a pseudo p-value
+    significant.
+
+    With ``exceedence`` permuted statistics already at least as extreme as
+    the observed one, the pseudo p-value after all permutations is at least
+    (exceedence + 1) / (permutations + 1).
+
+    Parameters
+    ----------
+    exceedence   : int
+                   number of permuted statistics so far at least as extreme
+                   as the observed statistic.
+    alpha        : float or None
+                   significance level, None disables early stopping.
+    permutations : int
+                   total number of permutations requested.
+
+    Returns
+    -------
+                 : bool
+    """
+    return alpha is not None and exceedence + 1 > alpha * (permutations + 1)
+
+
+def _temporal_degrees(t, tau):
+    """
+    Number of temporal neighbors of each event, |t_i - t_j| <= tau, j != i.
+
+    Parameters
+    ----------
+    t   : array
+          (n, ), event times.
+    tau : float
+          temporal threshold.
+
+    Returns
+    -------
+    nt  : array
+          (n, ), temporal degree of each event.
+
+    Notes
+    -----
+    The neighbors of t_i are a contiguous run of the sorted times, located
+    with searchsorted on t_i - tau and t_i + tau. Those shifted bounds round
+    differently from the pairwise difference, so for non-integer times the
+    run ends are then stepped until they agree with abs(t_i - t_j) <= tau,
+    the test used for the space-time pairs.
+    """
+    t_sorted = np.sort(t)
+    n = len(t_sorted)
+    lo = np.searchsorted(t_sorted, t - tau, side="left")
+    hi = np.searchsorted(t_sorted, t + tau, side="right")
+    while True:
+        lo_out = (lo > 0) & (np.abs(t - t_sorted[np.maximum(lo - 1, 0)]) <= tau)
+        lo_in = (lo < n) & (np.abs(t - t_sorted[np.minimum(lo, n - 1)]) > tau)
+        hi_out = (hi < n) & (np.abs(t - t_sorted[np.minimum(hi, n - 1)]) <= tau)
+        hi_in = (hi > 0) & (np.abs(t - t_sorted[np.maximum(hi - 1, 0)]) > tau)
+        if not (lo_out.any() or lo_in.any() or hi_out.any() or hi_in.any()):
+            return hi - lo - 1
+        lo = lo - lo_out + lo_in
+        hi = hi + hi_out - hi_in
+
+
+def _pairs_to_csr(pairs, n):
+    """
+    Convert an array of (i, j) index pairs to CSR arrays with rows i.
+
+    Parameters
+    ----------
+    pairs : array
+            (m, 2), neighbor pairs, e.g. as returned by ``KDTree.query_pairs``.
+    n     : int
+            number of observations.
+
+    Returns
+    -------
+    indptr  : array
+              (n + 1, ), offsets of each row into ``indices``.
+    indices : array
+              (m, ), column index of each pair, sorted within rows.
+
+    Notes
+    -----
+    Both arrays are int32 whenever n and m allow it, halving the memory
+    traffic of the permutation kernels that stream through them.
+    """
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    dtype = np.int32 if max(n, len(pairs)) < np.iinfo(np.int32).max else np.int64
+    indptr = np.zeros(n + 1, dtype=dtype)
+    np.cumsum(np.bincount(pairs[:, 0], minlength=n), out=indptr[1:])
+    return indptr, pairs[:, 1].astype(dtype)
+
+
+class _Coords:
+    """
+    Coordinate array that hashes and compares by a digest of its contents.
+
+    Used as a cache key: the caches hold only the digest once the array is
+    released, so sweeping parameters over the same events does not keep a
+    copy of the coordinates per cache entry.
+    """
+
+    __slots__ = ("array", "key")
+
+    def __init__(self, array):
+        self.array = array
+        self.key = (hashlib.blake2b(array).hexdigest(), array.shape, array.dtype.str)
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return isinstance(other, _Coords) and self.key == other.key
+
+
+def _spatial_pairs(s_coords, delta):
     """
-    Random permutation of rows and columns of a matrix
+    Spatial neighbor pairs within delta, reused across calls on the same data.
+
+    Studies of space-time interaction typically sweep over ``delta`` and
+    ``tau`` for a fixed set of events, so the KDTree and the pairs are cached
+    on a digest of the coordinates rather than rebuilt for every statistic.
 
     Parameters
     ----------
-    X   : array
-          (k, k), array to be permuted.
-    ids : array
-          range (k, ).
+    s_coords : array-like
+               (n, 2), spatial coordinates.
+    delta    : float
+               distance threshold.
 
     Returns
     -------
-        : array
-          (k, k) with rows and columns randomly shuffled.
+             : array
+               (m, 2), read-only pairs (i, j) with i < j in lexicographic
+               order.
+    """
+    coords = _Coords(np.ascontiguousarray(s_coords, dtype=np.float64))
+    try:
+        return _cached_pairs(coords, delta)
+    finally:
+        # the tree keeps its own copy of the data
+        coords.array = None
+
+
+@lru_cache(maxsize=4)
+def _cached_kdtree(coords):
+    # a private copy, so later in-place changes to the caller's array cannot
+    # alter a tree that is still cached under the old digest
+    return KDTree(coords.array, copy_data=True)
+
+
+@lru_cache(maxsize=8)
+def _cached_pairs(coords, delta):
+    pairs = _cached_kdtree(coords).query_pairs(r=delta, output_type="ndarray")
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    pairs.flags.writeable = False
+    return pairs
+
+
+def _knox_table(NST, NS, NT, pairs):
     """
-    np.random.shuffle(ids)
-    return X[ids, :][:, ids]
+    Observed and expected Knox tables with the Poisson p-value.
 
+    Parameters
+    ----------
+    NST   : float
+            number of space-time neighbor pairs.
+    NS    : float
+            number of spatial neighbor pairs.
+    NT    : float
+            number of temporal neighbor pairs.
+    pairs : float
+            total number of pairs, n * (n - 1) / 2.
 
-def _knox(s_coords, t_coords, delta, tau, permutations=99, keep=False):
+    Returns
+    -------
+    observed        : array
+                      (2, 2), space-time, spatial only, temporal only and
+                      neither counts.
+    expected        : array
+                      (2, 2), counts expected under independence of the
+                      margins; ``expected[0, 0]`` is NS * NT / pairs.
+    p_value_poisson : float
+                      probability of more than NST space-time pairs under a
+                      Poisson with mean ``expected[0, 0]``.
+    """
+    observed = np.array([[NST, NS - NST], [NT - NST, pairs - NS - NT + NST]])
+    expected = np.outer(observed.sum(axis=1), observed.sum(axis=0)) / pairs
+    return observed, expected, poisson.sf(NST, expected[0, 0])
+
+
+def _knox(
+    s_coords,
+    t_coords,
+    delta,
+    tau,
+    permutations=99,
+    keep=False,
+    return_pairs=False,
+    early_stop_alpha=None,
+):
     """
     Parameters
     ==========
@@ -679,6 +1182,12 @@ def _knox(s_coords, t_coords, delta, tau, permutations=99, keep=False):
         number of permutations
     keep: bool
         return values from permutations (default False)
+    return_pairs: bool
+        return the (i, j) space-time neighbor pairs with i < j as
+        ``st_pairs`` (default False)
+    early_stop_alpha: float
+        stop permuting once the pseudo p-value can no longer reach this level
+        (default None)
 
 
     Returns
@@ -694,108 +1203,77 @@ def _knox(s_coords, t_coords, delta, tau, permutations=99, keep=False):
     p-value
     """
 
+    # convert once; the tree, the threshold passes and the kernels all read
+    # these contiguous float64 buffers without further copies
+    s_coords = np.ascontiguousarray(s_coords, dtype=np.float64)
+    t_flat = np.ascontiguousarray(t_coords, dtype=np.float64).ravel()
     n = s_coords.shape[0]
 
-    stree = KDTree(s_coords)
-    ttree = KDTree(t_coords)
-    sneighbors = stree.query_ball_tree(stree, r=delta)
-    sneighbors = [
-        set(neighbors).difference([i]) for i, neighbors in enumerate(sneighbors)
-    ]
-    tneighbors = ttree.query_ball_tree(ttree, r=tau)
-    tneighbors = [
-        set(neighbors).difference([i]) for i, neighbors in enumerate(tneighbors)
-    ]
+    # spatial neighbor pairs (i, j), i < j, as one array from the tree
+    s_pairs = _spatial_pairs(s_coords, delta)
 
-    # number of spatial neighbor pairs
-    ns = np.array([len(neighbors) for neighbors in sneighbors])  # by i
+    # temporal degrees from runs of the sorted times, counted with the same
+    # abs(t_i - t_j) <= tau test as the space-time pairs below
+    nt = _temporal_degrees(t_flat, tau)
 
-    NS = ns.sum() / 2  # total
+    # s-t neighbors are the spatial neighbor pairs that are also close in
+    # time, found with one threshold pass over the spatial pairs
+    st_pairs = s_pairs[np.abs(t_flat[s_pairs[:, 0]] - t_flat[s_pairs[:, 1]]) <= tau]
 
-    # number of temporal neigbor pairs
-    nt = np.array([len(neighbors) for neighbors in tneighbors])
+    # number of spatial, temporal and spatio-temporal neighbor pairs
+    NS = float(len(s_pairs))
     NT = nt.sum() / 2
+    NST = float(len(st_pairs))
 
-    # s-t neighbors (list of lists)
-    stneighbors = [
-        sneighbors_i.intersection(tneighbors_i)
-        for sneighbors_i, tneighbors_i in zip(sneighbors, tneighbors)
-    ]
-
-    # number of spatio-temporal neigbor pairs
-    nst = np.array([len(neighbors) for neighbors in stneighbors])
-    NST = nst.sum() / 2
-
-    all_pairs = []
-    pairs = {}
-    for i, neigh in enumerate(stneighbors):
-        if len(neigh) > 0:
-            all_pairs.extend([sorted((i, j)) for j in neigh])
-    st_pairs = {tuple(l) for l in all_pairs}
-
-    # ENST: expected number of spatio-temporal neighbors under HO
     pairs = n * (n - 1) / 2
-    ENST = NS * NT / pairs
-
-    # observed table
-    observed = np.zeros((2, 2))
-
-    NS_ = NS - NST  # spatial only
-    NT_ = NT - NST  # temporal only
-
-    observed[0, 0] = NST
-    observed[0, 1] = NS_
-    observed[1, 0] = NT_
-    observed[1, 1] = pairs - NST - NS_ - NT_
-
-    # expected table
-
-    expected = np.zeros((2, 2))
-    expected[0, 0] = ENST
-    expected[0, 1] = NS - expected[0, 0]
-    expected[1, 0] = NT - expected[0, 0]
-    expected[1, 1] = pairs - expected.sum()
-
-    p_value_poisson = 1 - poisson.cdf(NST, expected[0, 0])
+    observed, expected, p_value_poisson = _knox_table(NST, NS, NT, pairs)
 
     results = {}
-    results["ns"] = ns.sum() / 2
-    results["nt"] = nt.sum() / 2
-    results["nst"] = nst.sum() / 2
+    results["ns"] = NS
+    results["nt"] = NT
+    results["nst"] = NST
     results["pairs"] = pairs
     results["expected"] = expected
     results["observed"] = observed
     results["p_value_poisson"] = p_value_poisson
-    results["st_pairs"] = st_pairs
-    results["sneighbors"] = sneighbors
-    results["tneighbors"] = tneighbors
-    results["stneighbors"] = stneighbors
+    results["s_pairs"] = s_pairs
+    if return_pairs:
+        results["st_pairs"] = st_pairs.astype(np.int64)
+    results["nt_i"] = nt
 
     if permutations > 0:
-        exceedence = 0
-        n = len(sneighbors)
-        ids = np.arange(n)
-        if keep:
-            ST = np.zeros(permutations)
-
-        for perm in range(permutations):
-            st = 0
-            rids = np.random.permutation(ids)
-            for i in range(n):
-                ri = rids[i]
-                tni = tneighbors[ri]
-                rjs = [rids[j] for j in sneighbors[i]]
-                sti = [j for j in rjs if j in tni]
-                st += len(sti)
-            st /= 2
-            if st >= results["nst"]:
-                exceedence += 1
-            if keep:
-                ST[perm] = st
-        results["p_value_sim"] = (exceedence + 1) / (permutations + 1)
+        # spatial adjacency is invariant under permutation of the times
+        s_indptr, s_indices = _pairs_to_csr(s_pairs, n)
+        # without keep only st >= NST matters, so counting may stop there
+        stop_at = np.iinfo(np.int64).max if keep else NST
+        if early_stop_alpha is None:
+            st = np.concatenate(
+                [
+                    _knox_perm_kernel(s_indptr, s_indices, t_flat, tau, block, stop_at)
+                    for block in _permutation_blocks(n, permutations)
+                ]
+            )
+        else:
+            st = np.empty(permutations, dtype=np.int32)
+            exceedence = 0
+            for perm in range(permutations):
+                st[perm] = _knox_perm_kernel(
+                    s_indptr,
+                    s_indices,
+                    t_flat,
+                    tau,
+                    _permutation_matrix(n, 1),
+                    stop_at,
+                )[0]
+                exceedence += st[perm] >= results["nst"]
+                if _stop_early(exceedence, early_stop_alpha, permutations):
+                    st = st[: perm + 1]
+                    break
+        exceedence = np.count_nonzero(st >= results["nst"])
+        results["p_value_sim"] = (exceedence + 1) / (st.shape[0] + 1)
         results["exceedence"] = exceedence
         if keep:
-            results["st_perm"] = ST
+            results["st_perm"] = st
 
     return results
 
@@ -819,6 +1297,9 @@ class Knox:
         number of random permutations for inference
     keep: bool
         whether to store realized values of the statistic under permutations
+    early_stop_alpha: float, optional
+        stop permuting once the pseudo p-value can no longer fall to this
+        significance level; p_sim then uses the permutations drawn so far
 
 
     Attributes
@@ -888,14 +1369,31 @@ class Knox:
     0.21
     """
 
-    def __init__(self, s_coords, t_coords, delta, tau, permutations=99, keep=False):
+    def __init__(
+        self,
+        s_coords,
+        t_coords,
+        delta,
+        tau,
+        permutations=99,
+        keep=False,
+        early_stop_alpha=None,
+    ):
         self.s_coords = s_coords
         self.t_coords = t_coords
         self.delta = delta
         self.tau = tau
         self.permutations = permutations
         self.keep = keep
-        results = _knox(s_coords, t_coords, delta, tau, permutations, keep)
+        results = _knox(
+            s_coords,
+            t_coords,
+            delta,
+            tau,
+            permutations,
+            keep,
+            early_stop_alpha=early_stop_alpha,
+        )
         self.nst = int(results["nst"])
         if permutations > 0:
             self.p_sim = results["p_value_sim"]
@@ -916,6 +1414,7 @@ class Knox:
         tau: int,
         permutations: int = 99,
         keep: bool = False,
+        early_stop_alpha: float = None,
     ):
         """Compute a Knox statistic from a dataframe of Point observations
 
@@ -939,6 +1438,9 @@ class Knox:
             permutations to use for computation inference, by default 99
         keep : bool
             whether to store realized values of the statistic under permutations
+        early_stop_alpha : float, optional
+            stop permuting once the pseudo p-value can no longer fall to this
+            significance level; p_sim then uses the permutations drawn so far
 
         Returns
         -------
@@ -948,7 +1450,123 @@ class Knox:
         """
         s_coords, t_coords = _spacetime_points_to_arrays(dataframe, time_col)
 
-        return cls(s_coords, dataframe[[time_col]], delta, tau, permutations, keep)
+        return cls(
+            s_coords,
+            dataframe[[time_col]],
+            delta,
+            tau,
+            permutations,
+            keep,
+            early_stop_alpha=early_stop_alpha,
+        )
+
+
+def knox_batch(param_grid, s_coords, t_coords, n_workers=None):
+    """Global Knox statistics for several parameter settings in parallel
+
+    Parameters
+    ----------
+    param_grid: iterable of dict
+        keyword arguments for `Knox` (delta, tau and optionally permutations,
+        keep, early_stop_alpha), one dict per statistic to compute
+    s_coords: array-like
+        spatial coordinates of point events
+    t_coords: array-like
+        temporal coordinates of point events (floats or ints, not dateTime)
+    n_workers: int, optional
+        number of worker processes; None uses one per CPU, and 1 computes
+        the statistics in the current process
+
+    Returns
+    -------
+    list of Knox
+        fitted `Knox` objects in the order of `param_grid`
+
+    Notes
+    -----
+    Each setting is seeded from the global numpy random state before any work
+    is dispatched, so results are reproducible with `numpy.random.seed` and do
+    not depend on the number of workers or the order in which they finish.
+    Either way the caller's random state only advances by those seeds. With
+    more than one worker, each worker runs the numba kernels on a single
+    thread to avoid oversubscribing the machine.
+
+    Workers are started with the ``spawn`` method, which re-imports the
+    calling script in each of them. A script that calls `knox_batch` with
+    more than one worker must therefore do so under an
+    ``if __name__ == "__main__":`` guard, as for any `multiprocessing` code
+    on Windows or macOS.
+
+    Examples
+    --------
+    >>> import libpysal
+    >>> path = libpysal.examples.get_path('burkitt.shp')
+    >>> import geopandas
+    >>> df = geopandas.read_file(path)
+    >>> from pointpats.spacetime import knox_batch
+    >>> grid = [dict(delta=20, tau=5), dict(delta=20, tau=10)]
+    >>> results = knox_batch(grid, df[['X', 'Y']], df[["T"]], n_workers=2)
+    >>> [knox.statistic_ for knox in results]
+    [13, 21]
+    """
+    s_coords = np.asarray(s_coords, dtype=float)
+    t_coords = np.asarray(t_coords, dtype=float)
+    param_grid = list(param_grid)
+    seeds = np.random.randint(np.iinfo(np.int32).max, size=len(param_grid))
+    # with several processes, each one keeps its numba kernels to one thread
+    # so the batch does not start a full thread pool per worker
+    in_worker = n_workers != 1
+    tasks = [
+        (s_coords, t_coords, params, seed, in_worker)
+        for params, seed in zip(param_grid, seeds, strict=True)
+    ]
+    if n_workers == 1:
+        # the tasks reseed the global state; leave the caller's stream as the
+        # workers would, advanced only by the seeds drawn above
+        state = np.random.get_state()
+        try:
+            return [_knox_batch_task(task) for task in tasks]
+        finally:
+            np.random.set_state(state)
+    # forking a process whose numba or BLAS thread pools are running can
+    # deadlock the children, so workers are started fresh
+    with ProcessPoolExecutor(
+        max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        results = list(executor.map(_knox_batch_task, tasks))
+    # the workers do not send the inputs back once per setting; all results
+    # share the arrays held here instead
+    for result in results:
+        result.s_coords, result.t_coords = s_coords, t_coords
+    return results
+
+
+def _knox_batch_task(task):
+    s_coords, t_coords, params, seed, in_worker = task
+    if HAS_NUMBA and in_worker:
+        set_num_threads(1)
+    np.random.seed(seed)
+    result = Knox(s_coords, t_coords, **params)
+    if in_worker:
+        result.s_coords = result.t_coords = None
+    return result
+
+
+KnoxResult = namedtuple(
+    "KnoxResult",
+    (
+        "nst",
+        "nsti",
+        "observed",
+        "expected",
+        "p_value_poisson",
+        "p_value_sim",
+        "exceedence_pvalue",
+        "hg_pvalues",
+        "sti_perm",
+        "stadjlist",
+    ),
+)
 
 
 def _knox_local(s_coords, t_coords, delta, tau, permutations=99, keep=False):
@@ -969,25 +1587,25 @@ def _knox_local(s_coords, t_coords, delta, tau, permutations=99, keep=False):
     keep: bool
         whether to store local statistics from the permtuations
 
+    Returns
+    -------
+    KnoxResult
+        global and local statistics; the permutation fields are None when
+        they were not computed or kept
+
     """
     # think about passing in the global object as an option to avoid recomputing the trees
-    res = _knox(s_coords, t_coords, delta, tau, permutations=permutations)
-    sneighbors = {i: tuple(ns) for i, ns in enumerate(res["sneighbors"])}
-    tneighbors = {i: tuple(nt) for i, nt in enumerate(res["tneighbors"])}
-
+    s_coords = np.ascontiguousarray(s_coords, dtype=np.float64)
+    t_flat = np.ascontiguousarray(t_coords, dtype=np.float64).ravel()
+    res = _knox(
+        s_coords, t_flat, delta, tau, permutations=permutations, return_pairs=True
+    )
     n = len(s_coords)
-    ids = np.arange(n)
-    res["nsti"] = np.zeros(n)  # number of observed st_pairs for observation i
-    res["nsi"] = [len(r) for r in res["sneighbors"]]
-    res["nti"] = [len(r) for r in res["tneighbors"]]
-    for pair in res["st_pairs"]:
-        i, j = pair
-        res["nsti"][i] += 1
-        res["nsti"][j] += 1
-
-    nsti = res["nsti"]
-    nsi = res["nsi"]
-    res["nti"]
+    # number of observed st_pairs for observation i: each pair adds one to
+    # both of its ends, i.e. the row sums of the symmetric st adjacency
+    nsti = np.bincount(res["st_pairs"].ravel(), minlength=n).astype(float)
+    nsi = np.bincount(res["s_pairs"].ravel(), minlength=n)
+    nti = res["nt_i"]
 
     # rather than do n*permutations, we reuse the permutations
     # ensuring that each permutation is conditional on a focal unit i
@@ -995,51 +1613,43 @@ def _knox_local(s_coords, t_coords, delta, tau, permutations=99, keep=False):
     # label at index i in the current permutation and the label at the index
     # assigned i in the permutation.
 
+    STI = exceedence_pvalue = None
     if permutations > 0:
-        exceedence = np.zeros(n)
+        # spatial neighbors of every focal unit, in both directions
+        pairs = res["s_pairs"]
+        indptr, indices = _pairs_to_csr(np.vstack((pairs, pairs[:, ::-1])), n)
+        # a unit without observed space-time neighbors is met or exceeded by
+        # every permutation, so it is only permuted when its draws are kept
+        focal = np.arange(n) if keep else np.flatnonzero(nsti > 0)
+        exceedence = np.full(n, permutations, dtype=np.int64)
+        exceedence[focal] = 0
         if keep:
-            STI = np.zeros((n, permutations))
-        for perm in range(permutations):
-            rids = np.random.permutation(ids)
-            for i in range(n):
-                rids_i = rids.copy()
-                # set observed value of focal unit i
-                # swap with value assigned to rids[i]
-                # example
-                # 0 1 2 (ids)
-                # 2 0 1 (rids)
-                # i=0
-                # 0 2 1 (rids_i)
-                # i=1
-                # 2 1 0 (rids_i)
-                # i=2
-                # 1 0 2 (rids_i)
-
-                rids_i[rids == i] = rids[i]
-                rids_i[i] = i
-
-                # calculate local stat
-                rjs = [rids_i[j] for j in sneighbors[i]]
-                tni = tneighbors[i]
-                sti = [j for j in rjs if j in tni]
-                count = len(sti)
-                if count >= res["nsti"][i]:
-                    exceedence[i] += 1
-                if keep:
-                    STI[i, perm] = count
-
-        if keep:
-            res["sti_perm"] = STI
-        res["exceedence_pvalue"] = (exceedence + 1) / (permutations + 1)
-        res["exceedences"] = exceedence
+            STI = np.empty((n, permutations), dtype=np.int32)
+        start = 0
+        # only running exceedence counts are carried between blocks unless
+        # the local draws are kept
+        for block in _permutation_blocks(n, permutations):
+            block_exceedence, block_sti = _knox_local_perm_kernel(
+                indptr, indices, t_flat, tau, block, focal, nsti, keep
+            )
+            exceedence[focal] += block_exceedence
+            if keep:
+                STI[:, start : start + block.shape[0]] = block_sti
+            start += block.shape[0]
+        exceedence_pvalue = (exceedence + 1) / (permutations + 1)
 
     # analytical inference
-    ntjis = [len(r) for r in res["tneighbors"]]
+    # the average over j only depends on the distinct temporal degrees, so
+    # evaluate the survival function once per (i, degree) and weight by counts
+    nt_values, nt_counts = np.unique(nti, return_counts=True)
     n1 = n - 1
-    hg_pvalues = [
-        1 - hypergeom.cdf(nsti[i] - 1, n1, ntjis, nsi[i]).mean() for i in range(n)
-    ]
-    res["hg_pvalues"] = np.array(hg_pvalues)
+    hg_pvalues = hypergeom.sf(
+        nsti[:, None] - 1,
+        n1,
+        nt_values[None, :],
+        nsi[:, None],
+    )
+    hg_pvalues = hg_pvalues @ nt_counts / n
 
     # identification of hot spots
 
@@ -1064,8 +1674,18 @@ def _knox_local(s_coords, t_coords, delta, tau, permutations=99, keep=False):
         else:
             adjlist.iloc[index, 2] = "coincident"
 
-    res["stadjlist"] = adjlist
-    return res
+    return KnoxResult(
+        nst=res["nst"],
+        nsti=nsti,
+        observed=res["observed"],
+        expected=res["expected"],
+        p_value_poisson=res["p_value_poisson"],
+        p_value_sim=res.get("p_value_sim"),
+        exceedence_pvalue=exceedence_pvalue,
+        hg_pvalues=hg_pvalues,
+        sti_perm=STI,
+        stadjlist=adjlist,
+    )
 
 
 class KnoxLocal:
@@ -1213,22 +1833,22 @@ class KnoxLocal:
         self.keep = keep
         self.crit = crit
         results = _knox_local(s_coords, t_coords, delta, tau, permutations, keep)
-        self.adjlist = results["stadjlist"]
-        self.nst = int(results["nst"])
+        self.adjlist = results.stadjlist
+        self.nst = int(results.nst)
         if permutations > 0:
-            self.p_sim = results["p_value_sim"]
+            self.p_sim = results.p_value_sim
             if keep:
-                self.sim = results["sti_perm"]
+                self.sim = results.sti_perm
 
-        self.p_poisson = results["p_value_poisson"]
-        self.observed = results["observed"]
-        self.expected = results["expected"]
-        self.p_hypergeom = results["hg_pvalues"]
+        self.p_poisson = results.p_value_poisson
+        self.observed = results.observed
+        self.expected = results.expected
+        self.p_hypergeom = results.hg_pvalues
         if permutations > 0:
-            self.p_sims = results["exceedence_pvalue"]
+            self.p_sims = results.exceedence_pvalue
             if keep:
-                self.sims = results["sti_perm"]
-        self.nsti = results["nsti"]
+                self.sims = results.sti_perm
+        self.nsti = results.nsti
         # self.hotspots = results["hotspots"]
         self._crs = crs
         self.statistic_ = self.nsti
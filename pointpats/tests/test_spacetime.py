@@ -7,12 +7,14 @@ from pytest import approx
 import pytest
 import matplotlib.pyplot as plt
 
+from pointpats import spacetime
 from pointpats import (
     Knox,
     KnoxLocal,
     SpaceTimeEvents,
     jacquez,
     knox,
+    knox_batch,
     mantel,
     modified_knox,
 )
@@ -97,6 +99,91 @@ class TestKnox:
         assert hasattr(global_knox, "sim") == True
         assert global_knox.p_sim == 0.21
 
+    def test_knox_reuses_spatial_tree(self):
+        from pointpats.spacetime import _cached_kdtree, _spatial_pairs
+
+        s_coords = self.gdf[["X", "Y"]].values
+        assert _spatial_pairs(s_coords, 20) is _spatial_pairs(s_coords.copy(), 20)
+        tree_misses = _cached_kdtree.cache_info().misses
+        for delta in (10, 15, 20):
+            global_knox = Knox(
+                self.gdf[["X", "Y"]], self.gdf[["T"]], delta=delta, tau=5
+            )
+            assert global_knox.observed.sum() == 188 * 187 / 2
+        assert _cached_kdtree.cache_info().misses == tree_misses
+
+    def test_knox_input_mutated_in_place(self):
+        from scipy.spatial import KDTree
+
+        # offset so no earlier test has cached a tree for these coordinates
+        s_coords = numpy.ascontiguousarray(self.gdf[["X", "Y"]].values + 0.5)
+        t_coords = self.gdf[["T"]].values
+        original = s_coords.copy()
+        Knox(s_coords, t_coords, delta=5, tau=5, permutations=0)
+        s_coords *= 0.1
+        Knox(s_coords, t_coords, delta=5, tau=5, permutations=0)
+        global_knox = Knox(original.copy(), t_coords, delta=8, tau=5, permutations=0)
+        n_pairs = len(KDTree(original).query_pairs(8))
+        assert global_knox.observed[0].sum() == n_pairs
+
+    def test_knox_float_times(self):
+        global_knox = Knox(
+            [[0, 0], [1, 0], [50, 50]],
+            [[9.9], [7.8], [0.0]],
+            delta=5,
+            tau=2.1,
+            permutations=0,
+        )
+        numpy.testing.assert_array_equal(global_knox.observed, [[0, 1], [0, 2]])
+
+        rng = numpy.random.default_rng(0)
+        s_coords = rng.uniform(0, 10, (40, 2))
+        i, j = numpy.triu_indices(40, 1)
+        for _ in range(50):
+            t_coords = numpy.round(rng.uniform(0, 20, (40, 1)), 1)
+            tau = round(rng.uniform(0, 5), 1)
+            close_s = numpy.hypot(*(s_coords[i] - s_coords[j]).T) <= 3
+            close_t = numpy.abs(t_coords[i, 0] - t_coords[j, 0]) <= tau
+            global_knox = Knox(s_coords, t_coords, delta=3, tau=tau, permutations=0)
+            assert global_knox.observed[0, 0] == (close_s & close_t).sum()
+            assert global_knox.observed[:, 0].sum() == close_t.sum()
+            assert global_knox.observed[0].sum() == close_s.sum()
+
+    def test_knox_early_stop(self):
+        numpy.random.seed(12345)
+        global_knox = Knox(
+            self.gdf[["X", "Y"]],
+            self.gdf[["T"]],
+            delta=20,
+            tau=5,
+            keep=True,
+            early_stop_alpha=0.05,
+        )
+        assert global_knox.statistic_ == 13
+        assert len(global_knox.sim) < 99
+        assert global_knox.p_sim > 0.05
+        gdf = self.gdf.set_crs(21096)
+        numpy.random.seed(12345)
+        gdf_knox = Knox.from_dataframe(
+            gdf, time_col="T", delta=20, tau=5, keep=True, early_stop_alpha=0.05
+        )
+        assert len(gdf_knox.sim) == len(global_knox.sim)
+        assert gdf_knox.p_sim == global_knox.p_sim
+
+    def test_knox_batch(self):
+        grid = [dict(delta=20, tau=5), dict(delta=20, tau=10, permutations=49)]
+        s_coords, t_coords = self.gdf[["X", "Y"]], self.gdf[["T"]]
+        numpy.random.seed(12345)
+        serial = knox_batch(grid, s_coords, t_coords, n_workers=1)
+        serial_next = numpy.random.rand()
+        numpy.random.seed(12345)
+        parallel = knox_batch(grid, s_coords, t_coords, n_workers=2)
+        assert [k.statistic_ for k in serial] == [13, 21]
+        assert [k.p_sim for k in serial] == [k.p_sim for k in parallel]
+        assert parallel[0].s_coords is parallel[1].s_coords
+        numpy.testing.assert_array_equal(parallel[1].t_coords, t_coords)
+        assert serial_next == numpy.random.rand()
+
 
 class TestKnoxLocal:
     def setup_method(self):
@@ -213,6 +300,31 @@ class TestKnoxLocal:
             ],
         )
 
+    def test_knox_local_float_times(self):
+        from scipy.stats import hypergeom
+
+        rng = numpy.random.default_rng(0)
+        s_coords = rng.uniform(0, 10, (40, 2))
+        d_s = numpy.hypot(*(s_coords[:, None] - s_coords[None]).transpose(2, 0, 1))
+        for _ in range(20):
+            t_coords = numpy.round(rng.uniform(0, 20, (40, 1)), 1)
+            tau = round(rng.uniform(0, 5), 1)
+            close_s = d_s <= 3
+            close_t = numpy.abs(t_coords - t_coords.T) <= tau
+            numpy.fill_diagonal(close_s, False)
+            numpy.fill_diagonal(close_t, False)
+            nsti = (close_s & close_t).sum(axis=1)
+            p_hypergeom = hypergeom.sf(
+                nsti[:, None] - 1,
+                39,
+                close_t.sum(axis=1)[None, :],
+                close_s.sum(axis=1)[:, None],
+            ).mean(axis=1)
+            local_knox = KnoxLocal(s_coords, t_coords, delta=3, tau=tau, permutations=0)
+            assert local_knox.observed[:, 0].sum() == close_t.sum() / 2
+            numpy.testing.assert_array_equal(local_knox.nsti, nsti)
+            numpy.testing.assert_allclose(local_knox.p_hypergeom, p_hypergeom)
+
     def test_knox_local_from_gdf(self):
         gdf = self.gdf
         gdf.crs = 21096
@@ -368,6 +480,58 @@ class TestKnoxLocal:
 
 
 
+@pytest.mark.skipif(not spacetime.HAS_NUMBA, reason="numba is not installed")
+class TestNumbaKernels:
+    def setup_method(self):
+        gdf = gpd.read_file(lps.examples.get_path("burkitt.shp"))
+        self.s_coords, self.t_coords = gdf[["X", "Y"]].values, gdf[["T"]].values
+
+    def _run(self, keep, early_stop_alpha=None):
+        numpy.random.seed(12345)
+        glob = Knox(
+            self.s_coords,
+            self.t_coords,
+            delta=20,
+            tau=5,
+            keep=keep,
+            early_stop_alpha=early_stop_alpha,
+        )
+        numpy.random.seed(12345)
+        local = KnoxLocal(self.s_coords, self.t_coords, delta=20, tau=5, keep=keep)
+        numpy.random.seed(12345)
+        legacy = knox(
+            self.s_coords,
+            self.t_coords,
+            delta=20,
+            tau=5,
+            early_stop_alpha=early_stop_alpha,
+        )
+        return glob, local, legacy
+
+    @pytest.mark.parametrize(
+        "keep, early_stop_alpha", [(True, None), (False, None), (True, 0.05)]
+    )
+    def test_matches_numpy(self, monkeypatch, keep, early_stop_alpha):
+        compiled = self._run(keep, early_stop_alpha)
+        monkeypatch.setattr(spacetime, "HAS_NUMBA", False)
+        monkeypatch.setattr(
+            spacetime, "_knox_perm_kernel", spacetime._knox_perm_kernel_numpy
+        )
+        monkeypatch.setattr(
+            spacetime,
+            "_knox_local_perm_kernel",
+            spacetime._knox_local_perm_kernel_numpy,
+        )
+        fallback = self._run(keep, early_stop_alpha)
+
+        assert compiled[0].p_sim == fallback[0].p_sim
+        numpy.testing.assert_array_equal(compiled[1].p_sims, fallback[1].p_sims)
+        assert compiled[2]["pvalue"] == fallback[2]["pvalue"]
+        if keep:
+            numpy.testing.assert_array_equal(compiled[0].sim, fallback[0].sim)
+            numpy.testing.assert_array_equal(compiled[1].sims, fallback[1].sims)
+
+
 # old tests refactored to pytest
 
 
@@ -407,3 +571,31 @@ class TestSpaceTimeEvents:
         )
 
         assert result["stat"] == approx(2.810160, rel=1e-4)
+
+    def test_modified_knox_float_times(self):
+        s_coords = numpy.array([[0, 0], [1, 0], [50, 50]])
+        t_coords = numpy.array([[9.9], [7.8], [0.0]])
+        assert modified_knox(s_coords, t_coords, 5, 2.1, permutations=0) == 0
+
+        rng = numpy.random.default_rng(0)
+        s_coords = rng.uniform(0, 10, (40, 2))
+        d_s = numpy.hypot(*(s_coords[:, None] - s_coords[None]).transpose(2, 0, 1))
+        for _ in range(50):
+            t_coords = numpy.round(rng.uniform(0, 20, (40, 1)), 1)
+            tau = round(rng.uniform(0, 5), 1)
+            close_s = d_s <= 3
+            close_t = numpy.abs(t_coords - t_coords.T) <= tau
+            numpy.fill_diagonal(close_s, False)
+            numpy.fill_diagonal(close_t, False)
+            expstat = close_s.sum(axis=1) @ close_t.sum(axis=1)
+            stat = ((close_s & close_t).sum() - expstat / 39) / 2
+            result = modified_knox(s_coords, t_coords, 3, tau, permutations=0)
+            assert result == approx(stat)
+
+    def test_early_stop(self):
+        numpy.random.seed(100)
+        result = mantel(self.events.space, self.events.t, 99, early_stop_alpha=0.05)
+        assert result["pvalue"] == approx(0.01)
+        numpy.random.seed(100)
+        result = jacquez(self.events.space, self.events.t, k=3, early_stop_alpha=0.05)
+        assert result["pvalue"] > 0.05